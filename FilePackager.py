@@ -2,9 +2,30 @@
 from struct import Struct, unpack, pack
 from io import BytesIO
 from math import ceil
+from array import array
+from bisect import bisect_left
+import heapq
+from collections import namedtuple, OrderedDict
+from collections.abc import MutableMapping
+import os
+import mmap
+import threading
+import concurrent.futures
+import hashlib
 UNICODE_STRING = 2
 ASCII_STRING = 1
 FILL_PATTERN = b'\xFF'
+# file_index 标记为已删除的行
+_DELETED_ROW = 0xFFFFFFFF
+# 追加条目超过此数量后重建排序索引
+_PENDING_LIMIT = 4096
+# 默认同时打开的文件句柄上限
+MAX_OPEN_FILES = 64
+# 导出时每次读写的块大小
+COPY_CHUNK_SIZE = 1 << 20
+MODE_NAMES = ('sbtitles', 'sbfiles', 'streamfiles')
+
+FileEntry = namedtuple('FileEntry', ('file_index', 'file_size', 'offset'))
 
 def byte2num(byt):
 	return int.from_bytes(byt, byteorder='little')
@@ -32,6 +53,135 @@ def get_string(fobj, location, string_mode):
 	return ''.join(name)
 
 
+# hash -> [FileEntry, ...] 的映射，条目按行存放在紧凑数组中
+# 按hash排序的索引用于查找，之后追加的条目先放在_pending里，积累到一定数量再重建索引
+class FileTable(MutableMapping):
+	__slots__ = ('_hashes', '_files', '_sizes', '_offsets', '_index_hashes', '_index_rows', '_pending', '_count')
+
+	def __init__(self):
+		self._hashes = array('Q')
+		self._files = array('I')
+		self._sizes = array('I')
+		self._offsets = array('Q')
+		self._index_hashes = array('Q')
+		self._index_rows = array('I')
+		self._pending = {}
+		self._count = 0
+
+	def _push(self, hash_num, file_index, file_size, offset):
+		self._hashes.append(hash_num)
+		self._files.append(file_index)
+		self._sizes.append(file_size)
+		self._offsets.append(offset)
+		return len(self._files) - 1
+
+	def _indexed_rows(self, hash_num):
+		rows = []
+		index_hashes = self._index_hashes
+		files = self._files
+		i = bisect_left(index_hashes, hash_num)
+		while i < len(index_hashes) and index_hashes[i] == hash_num:
+			row = self._index_rows[i]
+			if files[row] != _DELETED_ROW:
+				rows.append(row)
+			i += 1
+		return rows
+
+	def _rows(self, hash_num):
+		rows = self._indexed_rows(hash_num)
+		pending = self._pending.get(hash_num)
+		if pending:
+			rows.extend(pending)
+		return rows
+
+	def _reindex(self):
+		hashes = self._hashes
+		files = self._files
+		rows = [i for i in range(len(files)) if files[i] != _DELETED_ROW]
+		# 稳定排序，同一hash的行保持添加顺序
+		rows.sort(key=hashes.__getitem__)
+		self._index_rows = array('I', rows)
+		self._index_hashes = index_hashes = array('Q', [hashes[i] for i in rows])
+		self._pending = {}
+		if index_hashes:
+			self._count = 1 + sum(1 for a, b in zip(index_hashes, index_hashes[1:]) if a != b)
+		else:
+			self._count = 0
+
+	def append(self, hash_num, entry):
+		file_index, file_size, offset = entry
+		row = self._push(hash_num, file_index, file_size, offset)
+		pending = self._pending.get(hash_num)
+		if pending is not None:
+			pending.append(row)
+			return
+		if not self._indexed_rows(hash_num):
+			self._count += 1
+		self._pending[hash_num] = [row]
+		if len(self._pending) > _PENDING_LIMIT:
+			self._reindex()
+
+	@property
+	def nbytes(self):
+		return sum(len(i) * i.itemsize for i in (
+			self._hashes, self._files, self._sizes, self._offsets, self._index_hashes, self._index_rows))
+
+	def copy(self):
+		table = FileTable()
+		table._hashes = array('Q', self._hashes)
+		table._files = array('I', self._files)
+		table._sizes = array('I', self._sizes)
+		table._offsets = array('Q', self._offsets)
+		table._index_hashes = array('Q', self._index_hashes)
+		table._index_rows = array('I', self._index_rows)
+		table._pending = {hash_num: list(rows) for hash_num, rows in self._pending.items()}
+		table._count = self._count
+		return table
+
+	def __getitem__(self, hash_num):
+		rows = self._rows(hash_num)
+		if not rows:
+			raise KeyError(hash_num)
+		return [FileEntry(self._files[i], self._sizes[i], self._offsets[i]) for i in rows]
+
+	def __setitem__(self, hash_num, entries):
+		if hash_num in self:
+			del self[hash_num]
+		for entry in entries:
+			self.append(hash_num, entry)
+
+	def __delitem__(self, hash_num):
+		rows = self._rows(hash_num)
+		if not rows:
+			raise KeyError(hash_num)
+		for i in rows:
+			self._files[i] = _DELETED_ROW
+		self._pending.pop(hash_num, None)
+		self._count -= 1
+
+	def __contains__(self, hash_num):
+		return hash_num in self._pending or bool(self._indexed_rows(hash_num))
+
+	def get(self, hash_num, default=None):
+		rows = self._rows(hash_num)
+		if not rows:
+			return default
+		return [FileEntry(self._files[i], self._sizes[i], self._offsets[i]) for i in rows]
+
+	# 按hash顺序遍历，未索引的hash合并进来而不重建索引，遍历不修改表，可与其他读取同时进行
+	def __iter__(self):
+		files = self._files
+		indexed = (hash_num for hash_num, row in zip(self._index_hashes, self._index_rows) if files[row] != _DELETED_ROW)
+		last = None
+		for hash_num in heapq.merge(indexed, sorted(self._pending)):
+			if hash_num != last:
+				last = hash_num
+				yield hash_num
+
+	def __len__(self):
+		return self._count
+
+
 # 读取字典，文件对象一定要定位到字典开头
 def _load_files(table_buffer, files_map, lang_map, file_index, hashmode=1):
 	# 初始化信息解包
@@ -47,25 +197,194 @@ def _load_files(table_buffer, files_map, lang_map, file_index, hashmode=1):
 			raise Exception('不支持8字节以上hash')
 		info_struct = Struct(tmpstru)
 		del tmpstru
+		touched = set()
 		# 获取文件数量
-		for i in range(filenum):
-			hashsum, multi, file_size, offset, lang = info_struct.unpack(table_buffer.read(info_length))
+		for hashsum, multi, file_size, offset, lang in info_struct.iter_unpack(table_buffer.read(info_length * filenum)):
 			# 添加包id和音频id
 			lang = lang_map[lang]
 			if lang not in files_map:
-				stream_map = {}
+				stream_map = FileTable()
 				files_map[lang] = stream_map
 			else:
 				stream_map = files_map[lang]
-			if hashsum not in stream_map:
-				stream_map[hashsum] = [(file_index, file_size, offset * multi)]
-			else:
-				stream_map[hashsum].append((file_index, file_size, offset * multi))
+			stream_map._push(hashsum, file_index, file_size, offset * multi)
+			touched.add(lang)
+		for lang in touched:
+			files_map[lang]._reindex()
 
 
+def _pread(fd, offset, size):
+	chunks = []
+	while size > 0:
+		chunk = os.pread(fd, size, offset)
+		if not chunk:
+			break
+		chunks.append(chunk)
+		offset += len(chunk)
+		size -= len(chunk)
+	return b''.join(chunks)
+
+
+# 包与wem的来源列表，路径来源按需打开，超过上限时关闭最久未使用且未被占用的句柄
+# 直接传入的文件对象一直保持打开，由close统一关闭
+#
+# 并发约定：read只做按位置读取（os.pread、mmap切片或内存视图切片），不移动共享的文件指针，
+# 可以在多个线程中同时调用。add和close会修改来源列表，不能与read同时进行。
+# 没有fileno也没有内存缓冲的文件对象只能加锁seek+read，这类来源的读取是串行的。
+class SourcePool:
+	# lock: 与其他池共用的锁，共用文件对象来源时seek+read需要互斥
+	def __init__(self, max_open=MAX_OPEN_FILES, lock=None):
+		self.max_open = max(1, max_open)
+		self._sources = []
+		self._borrowed = set()
+		self._handles = OrderedDict()
+		self._maps = {}
+		self._readers = {}
+		self._leases = {}
+		self._lock = lock or threading.Lock()
+
+	# borrowed为True的文件对象来源属于其他池，close时不关闭
+	def add(self, source, borrowed=False):
+		if isinstance(source, os.PathLike):
+			source = os.fspath(source)
+		with self._lock:
+			self._sources.append(source)
+			index = len(self._sources) - 1
+			if borrowed and not isinstance(source, str):
+				self._borrowed.add(index)
+			return index
+
+	def is_path(self, index):
+		return isinstance(self._sources[index], str)
+
+	def name(self, index):
+		source = self._sources[index]
+		if isinstance(source, str):
+			return source
+		try:
+			return source.name
+		except AttributeError:
+			return 'Unknown'
+
+	def size(self, index):
+		source = self._sources[index]
+		if isinstance(source, str):
+			return os.path.getsize(source)
+		with self._lock:
+			position = source.tell()
+			source.seek(0, 2)
+			file_size = source.tell()
+			source.seek(position, 0)
+		return file_size
+
+	# 调用方需持有_lock
+	def _open(self, index):
+		handle = self._handles.get(index)
+		if handle is not None:
+			self._handles.move_to_end(index)
+			return handle
+		self._trim(self.max_open - 1)
+		handle = open(self._sources[index], 'rb')
+		self._handles[index] = handle
+		# 没有pread的平台（Windows）改用只读映射
+		if not hasattr(os, 'pread') and os.fstat(handle.fileno()).st_size:
+			self._maps[index] = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+		return handle
+
+	def _trim(self, limit):
+		if len(self._handles) <= limit:
+			return
+		for index in list(self._handles):
+			if index not in self._leases:
+				if index in self._maps:
+					self._maps.pop(index).close()
+				self._handles.pop(index).close()
+				if len(self._handles) <= limit:
+					return
+
+	# 调用方需持有_lock，返回文件对象来源的读取方式
+	def _object_reader(self, index, source):
+		reader = self._readers.get(index)
+		if reader is None:
+			raw = getattr(source, 'raw', source)
+			# 借用的来源不导出缓冲区，否则所有者无法关闭它
+			if hasattr(raw, 'getbuffer') and index not in self._borrowed:
+				reader = ('view', raw.getbuffer())
+			else:
+				try:
+					reader = ('fd', source.fileno()) if hasattr(os, 'pread') else ('lock', None)
+				except (AttributeError, OSError):
+					reader = ('lock', None)
+			self._readers[index] = reader
+		return reader
+
+	def __getitem__(self, index):
+		source = self._sources[index]
+		if not isinstance(source, str):
+			return source
+		with self._lock:
+			return self._open(index)
+
+	# 按位置读取，不依赖共享的文件指针
+	def read(self, index, offset, size):
+		source = self._sources[index]
+		if not isinstance(source, str):
+			with self._lock:
+				kind, reader = self._object_reader(index, source)
+				if kind == 'lock':
+					source.seek(offset, 0)
+					return source.read(size)
+			if kind == 'view':
+				return bytes(reader[offset:offset + size])
+			return _pread(reader, offset, size)
+		with self._lock:
+			handle = self._open(index)
+			self._leases[index] = self._leases.get(index, 0) + 1
+		try:
+			if index in self._maps:
+				return self._maps[index][offset:offset + size]
+			if hasattr(os, 'pread'):
+				return _pread(handle.fileno(), offset, size)
+			return b''
+		finally:
+			with self._lock:
+				if self._leases[index] == 1:
+					del self._leases[index]
+				else:
+					self._leases[index] -= 1
+				self._trim(self.max_open)
+
+	def __len__(self):
+		return len(self._sources)
+
+	@property
+	def open_count(self):
+		return len(self._handles)
+
+	def close(self):
+		with self._lock:
+			for kind, reader in self._readers.values():
+				if kind == 'view':
+					reader.release()
+			self._readers.clear()
+			for i in self._maps.values():
+				i.close()
+			self._maps.clear()
+			for handle in self._handles.values():
+				handle.close()
+			self._handles.clear()
+			for index, source in enumerate(self._sources):
+				if not isinstance(source, str) and index not in self._borrowed:
+					source.close()
+			self._sources = []
+			self._borrowed.clear()
+
+
+# 表加载完成后，get_file_data_by_hash、extract_files和build_pck_file的读取都可以多线程同时进行，
+# 无需额外加锁；addfile、add_wem、del_hash_files会修改表，需要与读取错开
 class Package:
 	# 初始化查询字典
-	def __init__(self, string_mode=UNICODE_STRING, log=None):
+	def __init__(self, string_mode=UNICODE_STRING, log=None, max_open_files=MAX_OPEN_FILES):
 		self.LANGUAGE_DEF = {
 			"SFX": 0,
 			'ENGLISH(US)': 1,
@@ -83,30 +402,36 @@ class Package:
 		self.sbfiles_map = {}
 		self.sbtitles_map = {}
 		self.map = (self.sbtitles_map, self.sbfiles_map, self.streamfiles_map)
-		self.file_list = []
+		self.file_list = SourcePool(max_open_files)
+		self.package_indexes = set()
 		self._log = log
 
-	# 添加包
+	# 添加包，可传入路径（按需打开）或已打开的文件对象
 	def addfile(self, fobj):
+		file_index = self.file_list.add(fobj)
+		self.package_indexes.add(file_index)
+		if self.file_list.is_path(file_index):
+			header = self.file_list.read(file_index, 0, 28)
+		else:
+			header = fobj.read(28)
 		# 判断文件头
-		if fobj.read(4) != b'AKPK':
+		if header[:4] != b'AKPK':
 			assert '格式不正确'
 		# 解包偏移参数
-		header_size, pck_version, languages_size, sbtitles_size, sbfiles_size, streamfiles_size = unpack('<6I', fobj.read(24))
+		header_size, pck_version, languages_size, sbtitles_size, sbfiles_size, streamfiles_size = unpack('<6I', header[4:])
 		if pck_version != 1:
 			if self._log:
 				self._log.logging(r'包版本：' + str(pck_version))
+		if self.file_list.is_path(file_index):
+			fobj = BytesIO(self.file_list.read(file_index, 28, languages_size + sbtitles_size + sbfiles_size + streamfiles_size))
 		lang_def_trans_map = self._load_language_def(BytesIO(fobj.read(languages_size)))
 
-		file_index = len(self.file_list)
-		self.file_list.append(fobj)
 		self._load_bank_title(BytesIO(fobj.read(sbtitles_size)), lang_def_trans_map, file_index)
 		self._load_bank_file(BytesIO(fobj.read(sbfiles_size)), lang_def_trans_map, file_index)
 		self._load_stream_file(BytesIO(fobj.read(streamfiles_size)), lang_def_trans_map, file_index)
 
 	# 根据hash获取文件数据
 	def get_file_data_by_hash(self, hash_num, langid=0, mode=0, get_latest=True):
-		print(hash_num)
 		hash_info = self.map[mode]
 		hashmap = hash_info[langid]
 		if hash_num not in hashmap:
@@ -118,13 +443,7 @@ class Package:
 		result = []
 		for j in hash_data:
 			file_id, file_size, file_offset = j
-			fobj = self.file_list[file_id]
-			fobj.seek(file_offset, 0)
-			try:
-				fname = fobj.name
-			except AttributeError:
-				fname = 'Unknown'
-			result.append((fobj.read(file_size), fname))
+			result.append((self.file_list.read(file_id, file_offset, file_size), self.file_list.name(file_id)))
 		return result
 
 	def del_hash_files(self, hash_num, mode):
@@ -134,20 +453,14 @@ class Package:
 			if hash_num in maps:
 				del maps[hash_num]
 
+	# wem可传入路径或文件对象，路径在写包时才打开
 	def add_wem(self, mode, lang_id, hash_num, wem_file_obj):
 		hash_map = self.map[mode]
-		ind = len(self.file_list)
-		self.file_list.append(wem_file_obj)
-		wem_file_obj.seek(0, 2)
-		file_size = wem_file_obj.tell()
-		wem_file_obj.seek(0, 0)
-		data = (ind, file_size, 0)
-		if lang_id in hash_map:
-			if hash_num not in hash_map[lang_id]:
-				hash_map[lang_id][hash_num] = []
-			hash_map[lang_id][hash_num].append(data)
-		else:
-			hash_map[lang_id] = {hash_num: [data]}
+		ind = self.file_list.add(wem_file_obj)
+		file_size = self.file_list.size(ind)
+		if lang_id not in hash_map:
+			hash_map[lang_id] = FileTable()
+		hash_map[lang_id].append(hash_num, FileEntry(ind, file_size, 0))
 
 	def _load_language_def(self, bytestream):
 		mapnum = byte2num(bytestream.read(4))
@@ -179,9 +492,124 @@ class Package:
 			language = self.LANGUAGE_DEF[language]
 		return language
 
+	# 复制文件表，副本有自己的SourcePool，按需重新打开路径来源；修改副本不影响原包
+	# 文件对象来源由副本借用，关闭或回收副本不会关闭它，原包关闭后副本无法再读取这些来源
+	def copy(self):
+		package = Package(self._string_mode, self._log, self.file_list.max_open)
+		package.LANGUAGE_DEF = dict(self.LANGUAGE_DEF)
+		for source_map, target_map in zip(self.map, package.map):
+			for lang_id, table in source_map.items():
+				target_map[lang_id] = table.copy()
+		package.file_list = SourcePool(self.file_list.max_open, self.file_list._lock)
+		for source in self.file_list._sources:
+			package.file_list.add(source, borrowed=True)
+		package.package_indexes = set(self.package_indexes)
+		return package
+
+	# 文件表占用的内存
+	@property
+	def nbytes(self):
+		return sum(table.nbytes for hash_map in self.map for table in hash_map.values())
+
+	def close(self):
+		self.file_list.close()
+
 	def __del__(self):
-		for i in self.file_list:
-			i.close()
+		self.close()
+
+
+def _guess_extension(head):
+	if head[:4] == b'RIFF':
+		return '.wem'
+	if head[:4] == b'BKHD':
+		return '.bnk'
+	return '.bin'
+
+
+def _same_content(class_obj, file_index, file_offset, file_size, path):
+	try:
+		if os.path.getsize(path) != file_size:
+			return False
+		with open(path, 'rb') as f:
+			done = 0
+			while done < file_size:
+				lens = min(COPY_CHUNK_SIZE, file_size - done)
+				if f.read(lens) != class_obj.file_list.read(file_index, file_offset + done, lens):
+					return False
+				done += lens
+		return True
+	except OSError:
+		return False
+
+
+# 导出单个文件，目标已存在且内容一致时跳过，返回(路径, 写入字节数或None)
+def _extract_entry(class_obj, entry, base_path):
+	file_index, file_size, file_offset = entry
+	head = class_obj.file_list.read(file_index, file_offset, min(file_size, COPY_CHUNK_SIZE))
+	path = base_path + _guess_extension(head)
+	if _same_content(class_obj, file_index, file_offset, file_size, path):
+		return path, None
+	with open(path, 'wb') as f:
+		f.write(head)
+		done = len(head)
+		while done < file_size:
+			chunk = class_obj.file_list.read(file_index, file_offset + done, min(COPY_CHUNK_SIZE, file_size - done))
+			if not chunk:
+				break
+			f.write(chunk)
+			done += len(chunk)
+	return path, done
+
+
+def _check_for_mode(mode):
+	if isinstance(mode, str):
+		if mode.lower() not in MODE_NAMES:
+			raise Exception('找不到对应类型')
+		return MODE_NAMES.index(mode.lower())
+	return mode
+
+
+# 批量导出，可按类型、语言和hash过滤，输出到 output_dir/类型/语言/hash.扩展名
+# 多个线程按位置读取，内存占用受线程数和块大小限制
+def extract_files(class_obj, output_dir, modes=None, languages=None, hashes=None, hash_names=False, max_workers=None):
+	modes = [_check_for_mode(i) for i in modes] if modes is not None else range(len(MODE_NAMES))
+	languages = None if languages is None else {class_obj._check_for_language(i) for i in languages}
+	lang_names = {class_obj.LANGUAGE_DEF[i]: i.lower() for i in class_obj.LANGUAGE_DEF}
+	jobs = []
+	for mode in modes:
+		for lang_id, table in class_obj.map[mode].items():
+			if languages is not None and lang_id not in languages:
+				continue
+			folder = os.path.join(output_dir, MODE_NAMES[mode], lang_names.get(lang_id, str(lang_id)))
+			selected = table if hashes is None else [i for i in hashes if i in table]
+			if selected:
+				os.makedirs(folder, exist_ok=True)
+			for hash_num in selected:
+				name = '%016x' % hash_num if hash_names else str(hash_num)
+				jobs.append((table[hash_num][-1], os.path.join(folder, name)))
+
+	result = {'written': 0, 'skipped': 0, 'bytes': 0}
+	max_workers = max_workers or min(32, (os.cpu_count() or 1) + 4)
+	with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+		pending = set()
+		jobs = iter(jobs)
+		while True:
+			# 限制同时提交的任务数
+			for entry, base_path in jobs:
+				pending.add(executor.submit(_extract_entry, class_obj, entry, base_path))
+				if len(pending) >= max_workers * 4:
+					break
+			if not pending:
+				break
+			done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+			for future in done:
+				path, written = future.result()
+				if written is not None:
+					result['written'] += 1
+					result['bytes'] += written
+				else:
+					result['skipped'] += 1
+	return result
 
 
 def fnv_hash_64(data: str):
@@ -200,7 +628,10 @@ def fnv_hash_32(data: str):
 	return hash_num
 
 
-def build_pck_file(class_obj, fobj, language_def):
+# 计算生成包的布局而不写入任何数据
+# alignment: 每个文件起始位置的对齐字节数（如2048、4096），不足部分用FILL_PATTERN填充
+# access_order: 按读取顺序排列的hash列表，这些文件的数据按此顺序连续存放，其余文件排在后面
+def plan_pck_file(class_obj, language_def, alignment=1, access_order=None):
 	# 处理字符串map
 	def str_encoder(name: str):
 		encoded_bytes = BytesIO()
@@ -235,11 +666,10 @@ def build_pck_file(class_obj, fobj, language_def):
 		return fbuf.getvalue()
 
 	# Precompute the size, sort the hash, and return the size information using the language id and file location
-	def pre_calculate_files_info(mode, if_output_file_size):
+	def pre_calculate_files_info(mode):
 		size = 1
 		hash_data = {}
 		base_count = (5, 5, 6)[mode]
-		files_size = 0
 		smap = class_obj.map[mode]
 		lang_id = list(smap.keys())
 		for single_lang in lang_id:
@@ -249,53 +679,48 @@ def build_pck_file(class_obj, fobj, language_def):
 				size += lens * base_count
 			for i in lang_map:
 				info = lang_map[i][-1]
-				if if_output_file_size:
-					files_size += info[1]
 				try:
 					hash_data[i][single_lang] = info
 				except KeyError:
 					hash_data[i] = {single_lang: info}
 
-		return size * 4, lang_id, sorted(hash_data.items(), key=lambda d: d[0]), files_size
-
-	def build_file_map(mode, map_data, init_offset):
-		if mode:
-			unpack_code = r'<5I'
-		else:
-			unpack_code = r'<Q4I'
-		packer = Struct(unpack_code)
-		file_list = []
-		fobj.write(num2bytes(len(map_data)))
-		for hash_info in map_data:
-			hash_num, value = hash_info
-			value = sorted(value.items(), key=lambda d: d[0])
-			for i in value:
-				offset_multiplicand = (init_offset >> 32) + 1
-				offset_multiplier = ceil(init_offset/offset_multiplicand)
-				fill_bytes = init_offset % offset_multiplicand
-				lang_id, i = i
-				package_id, file_size, origin_offset = i
-				file_list.append((package_id, file_size, origin_offset, fill_bytes))
-				fobj.write(packer.pack(hash_num, offset_multiplicand, file_size, offset_multiplier, lang_id))
-				init_offset += (fill_bytes + file_size)
-
-		return file_list
-
-	def write_audio_data(file_list):
-		for package_id, file_size, origin_offset, fill_bytes in file_list:
-			file = class_obj.file_list[package_id]
-			file.seek(origin_offset, 0)
-			fobj.write(file.read(file_size))
-			if fill_bytes:
-				fobj.write(FILL_PATTERN * fill_bytes)
+		return size * 4, lang_id, sorted(hash_data.items(), key=lambda d: d[0])
+
+	# 为每个文件分配位置，起始位置按alignment对齐，access_order中的hash按顺序排在前面
+	# 返回 {(类型, hash, 语言id): (块大小, 偏移倍数)}、写入顺序和填充字节总数
+	def layout_files(files_info, init_offset):
+		placement = []
+		for mode, map_data in files_info:
+			for hash_num, value in map_data:
+				for lang_id, info in sorted(value.items(), key=lambda d: d[0]):
+					placement.append(((mode, hash_num, lang_id), info))
+		if access_order:
+			rank = {hash_num: i for i, hash_num in enumerate(access_order)}
+			placement.sort(key=lambda d: rank.get(d[0][1], len(rank)))
+		locations = {}
+		write_list = []
+		padding = 0
+		offset = init_offset
+		for key, (package_id, file_size, origin_offset) in placement:
+			# 偏移倍数只有4字节，超出时增大块大小
+			offset_multiplicand = alignment * ((offset // alignment >> 32) + 1)
+			start = ceil(offset / offset_multiplicand) * offset_multiplicand
+			locations[key] = (offset_multiplicand, start // offset_multiplicand)
+			write_list.append((package_id, file_size, origin_offset, start - offset))
+			padding += start - offset
+			offset = start + file_size
+		return locations, write_list, padding, offset
+
+	alignment = max(1, alignment)
+	header = BytesIO()
 
 	# Build header
-	fobj.write(b'AKPK')  # 文件magic
+	header.write(b'AKPK')  # 文件magic
 
 	# Precalculations 
-	bt_size, bt_langid, bt_hash, bt_file_size = pre_calculate_files_info(0, True)
-	bf_size, bf_langid, bf_hash, bf_file_size = pre_calculate_files_info(1, True)
-	sf_size, sf_langid, sf_hash, _ = pre_calculate_files_info(2, True)
+	bt_size, bt_langid, bt_hash = pre_calculate_files_info(0)
+	bf_size, bf_langid, bf_hash = pre_calculate_files_info(1)
+	sf_size, sf_langid, sf_hash = pre_calculate_files_info(2)
 
 	# Create LanguageMap
 	langid = list(set(bt_langid + bf_langid + sf_langid + [0]))
@@ -305,27 +730,218 @@ def build_pck_file(class_obj, fobj, language_def):
 
 	# Calculate offset 
 	header_size = language_map_size + bt_size + bf_size + sf_size + 20
-	fobj.write(pack('<6I', header_size, 1, language_map_size, bt_size, bf_size, sf_size))
+	header.write(pack('<6I', header_size, 1, language_map_size, bt_size, bf_size, sf_size))
 	del bt_size, bf_size, sf_size
 
 	# Write to LanguageMap
-	fobj.write(language_map)
+	header.write(language_map)
 	header_size += 8
 
-	# Construct File Look-Up Table and write
-	bt_file_write_info = build_file_map(1, bt_hash, header_size)
-	del bt_hash
-	header_size += bt_file_size
+	# Place audio data
+	tables = ((0, bt_hash), (1, bf_hash), (2, sf_hash))
+	locations, write_list, padding, file_size = layout_files(tables, header_size)
+	return {
+		'header': header.getvalue(),
+		'tables': tables,
+		'locations': locations,
+		'write_list': write_list,
+		'padding': padding,
+		'data_offset': header_size,
+		'size': file_size,
+	}
+
+
+# 参数同plan_pck_file，返回填充字节总数
+def build_pck_file(class_obj, fobj, language_def, alignment=1, access_order=None):
+	def build_file_map(mode, map_data, locations):
+		if mode == 2:
+			unpack_code = r'<Q4I'
+		else:
+			unpack_code = r'<5I'
+		packer = Struct(unpack_code)
+		fobj.write(pack('<I', len(map_data)))
+		for hash_info in map_data:
+			hash_num, value = hash_info
+			for lang_id in sorted(value):
+				offset_multiplicand, offset_multiplier = locations[(mode, hash_num, lang_id)]
+				fobj.write(packer.pack(hash_num, offset_multiplicand, value[lang_id][1], offset_multiplier, lang_id))
 
-	bf_file_write_info = build_file_map(1, bf_hash, header_size)
-	del bf_hash
-	header_size += bf_file_size
+	def write_audio_data(file_list):
+		for package_id, file_size, origin_offset, fill_bytes in file_list:
+			if fill_bytes:
+				fobj.write(FILL_PATTERN * fill_bytes)
+			done = 0
+			while done < file_size:
+				chunk = class_obj.file_list.read(package_id, origin_offset + done, min(COPY_CHUNK_SIZE, file_size - done))
+				if not chunk:
+					break
+				fobj.write(chunk)
+				done += len(chunk)
 
-	sf_file_write_info = build_file_map(0, sf_hash, header_size)
-	del sf_hash
+	plan = plan_pck_file(class_obj, language_def, alignment, access_order)
+	fobj.write(plan['header'])
+
+	# Construct File Look-Up Table and write
+	for mode, map_data in plan['tables']:
+		build_file_map(mode, map_data, plan['locations'])
 
 	# Write audio file data
-	write_audio_data(bt_file_write_info)
-	write_audio_data(bf_file_write_info)
-	write_audio_data(sf_file_write_info)
+	write_audio_data(plan['write_list'])
+	return plan['padding']
+
 
+# 统计布局的数据来源：original_bytes来自已加载的包，replaced_bytes来自add_wem添加的文件
+def summarize_pck_plan(class_obj, plan):
+	original_bytes = 0
+	replaced_bytes = 0
+	for package_id, file_size, origin_offset, fill_bytes in plan['write_list']:
+		if package_id in class_obj.package_indexes:
+			original_bytes += file_size
+		else:
+			replaced_bytes += file_size
+	return {
+		'size': plan['size'],
+		'table_bytes': plan['data_offset'],
+		'entries': {MODE_NAMES[mode]: sum(len(value) for _, value in map_data) for mode, map_data in plan['tables']},
+		'original_bytes': original_bytes,
+		'replaced_bytes': replaced_bytes,
+		'padding': plan['padding'],
+	}
+
+
+# 读取已生成包的文件表，返回 (类型, 表项在文件中的位置, hash, 块大小, 文件大小, 偏移倍数, 包内语言id) 列表和语言映射
+def _read_file_entries(fobj):
+	fobj.seek(0, 0)
+	if fobj.read(4) != b'AKPK':
+		raise PackageFormatError('格式不正确')
+	header_size, pck_version, languages_size, sbtitles_size, sbfiles_size, streamfiles_size = unpack('<6I', fobj.read(24))
+	lang_map = Package()._load_language_def(BytesIO(fobj.read(languages_size)))
+	entries = []
+	position = 28 + languages_size
+	for mode, table_size in enumerate((sbtitles_size, sbfiles_size, streamfiles_size)):
+		info_struct = Struct(r'<Q4I' if mode == 2 else r'<5I')
+		fobj.seek(position, 0)
+		filenum = byte2num(fobj.read(4))
+		table = fobj.read(info_struct.size * filenum)
+		for i, info in enumerate(info_struct.iter_unpack(table)):
+			entries.append((mode, position + 4 + i * info_struct.size) + info)
+		position += table_size
+	return entries, lang_map
+
+
+# 原地更新已生成包中的文件，replacements为 {hash: wem路径}
+# 新数据不超过原位置可用空间时原地覆盖，否则追加到文件末尾并改写表项，返回 {hash: 'inplace'/'appended'}
+def update_pck_entries(path, mode, lang_id, replacements):
+	result = {}
+	with open(path, 'r+b') as fobj:
+		entries, lang_map = _read_file_entries(fobj)
+		fobj.seek(0, 2)
+		end = fobj.tell()
+		starts = sorted(multi * offset for _, _, _, multi, _, offset, _ in entries)
+		# 追加到末尾的数据不计入原有文件的可用空间
+		starts.append(end)
+		for entry_mode, entry_pos, hash_num, multi, file_size, offset, lang in entries:
+			if entry_mode != mode or lang_map.get(lang) != lang_id or hash_num not in replacements:
+				continue
+			with open(replacements[hash_num], 'rb') as wem:
+				data = wem.read()
+			start = multi * offset
+			next_index = bisect_left(starts, start + 1)
+			capacity = starts[next_index] - start if next_index < len(starts) else 0
+			if len(data) <= capacity:
+				fobj.seek(start, 0)
+				fobj.write(data)
+				result[hash_num] = 'inplace'
+			else:
+				multi = max(multi, (end >> 32) + 1)
+				start = ceil(end / multi) * multi
+				fobj.seek(end, 0)
+				fobj.write(FILL_PATTERN * (start - end))
+				fobj.write(data)
+				end = start + len(data)
+				offset = start // multi
+				result[hash_num] = 'appended'
+			# 表项中hash之后依次为块大小、文件大小、偏移倍数
+			fobj.seek(entry_pos + (8 if mode == 2 else 4), 0)
+			fobj.write(pack('<3I', multi, len(data), offset))
+	return result
+
+
+# 计算单个文件数据的摘要
+def _payload_digest(class_obj, entry):
+	file_index, file_size, file_offset = entry
+	digest = hashlib.blake2b(digest_size=16)
+	done = 0
+	while done < file_size:
+		lens = min(COPY_CHUNK_SIZE, file_size - done)
+		digest.update(class_obj.file_list.read(file_index, file_offset + done, lens))
+		done += lens
+	return digest.digest()
+
+
+# 比较两组包的文件表，返回 {类型名: {语言id: {'added', 'removed', 'resized', 'moved', 'changed': [hash]}}}
+# 大小不同视为已修改；大小相同但位置（包名、偏移）不同时才读取数据比较摘要，区分仅移动和内容修改；位置大小都相同视为未变
+# verify为True时位置大小都相同的文件也比较摘要，用于原地改写内容的包
+def diff_packages(old_obj, new_obj, max_workers=None, verify=False):
+	def location(class_obj, entry):
+		return os.path.basename(class_obj.file_list.name(entry.file_index)), entry.offset
+
+	result = {}
+	candidates = []
+	for mode, mode_name in enumerate(MODE_NAMES):
+		old_map = old_obj.map[mode]
+		new_map = new_obj.map[mode]
+		for lang_id in set(old_map) | set(new_map):
+			old_table = old_map.get(lang_id, {})
+			new_table = new_map.get(lang_id, {})
+			lang_diff = {'added': [], 'removed': [], 'resized': [], 'moved': [], 'changed': []}
+			for hash_num in new_table:
+				if hash_num not in old_table:
+					lang_diff['added'].append(hash_num)
+					continue
+				old_entry = old_table[hash_num][-1]
+				new_entry = new_table[hash_num][-1]
+				if old_entry.file_size != new_entry.file_size:
+					lang_diff['resized'].append(hash_num)
+				elif location(old_obj, old_entry) != location(new_obj, new_entry):
+					candidates.append((lang_diff, hash_num, old_entry, new_entry, True))
+				elif verify:
+					candidates.append((lang_diff, hash_num, old_entry, new_entry, False))
+			lang_diff['removed'] = [hash_num for hash_num in old_table if hash_num not in new_table]
+			result.setdefault(mode_name, {})[lang_id] = lang_diff
+
+	max_workers = max_workers or min(32, (os.cpu_count() or 1) + 4)
+	with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+		old_digests = executor.map(_payload_digest, [old_obj] * len(candidates), [i[2] for i in candidates])
+		new_digests = executor.map(_payload_digest, [new_obj] * len(candidates), [i[3] for i in candidates])
+		for (lang_diff, hash_num, _, _, moved), old_digest, new_digest in zip(candidates, old_digests, new_digests):
+			if old_digest != new_digest:
+				lang_diff['changed'].append(hash_num)
+			elif moved:
+				lang_diff['moved'].append(hash_num)
+
+	# 去掉没有变化的语言和类型
+	for mode_name in list(result):
+		for lang_id in list(result[mode_name]):
+			lang_diff = result[mode_name][lang_id]
+			for key in lang_diff:
+				lang_diff[key].sort()
+			if not any(lang_diff.values()):
+				del result[mode_name][lang_id]
+		if not result[mode_name]:
+			del result[mode_name]
+	return result
+
+
+# 内容可能已变化的hash（新增、删除、大小或内容修改），仅移动的不计入
+def changed_hashes(diff, mode=None, lang_id=None):
+	hashes = set()
+	for mode_name, mode_diff in diff.items():
+		if mode is not None and mode_name != MODE_NAMES[_check_for_mode(mode)]:
+			continue
+		for diff_lang, lang_diff in mode_diff.items():
+			if lang_id is not None and diff_lang != lang_id:
+				continue
+			for key in ('added', 'removed', 'resized', 'changed'):
+				hashes.update(lang_diff[key])
+	return hashes
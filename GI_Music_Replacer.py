@@ -6,31 +6,112 @@ import struct
 import sys
 import concurrent.futures
 import shutil
-from io import BufferedReader, BytesIO
-from FilePackager import Package, build_pck_file
+import argparse
+import json
+import mmap
+from collections import namedtuple, OrderedDict
+from FilePackager import Package, build_pck_file, plan_pck_file, summarize_pck_plan, extract_files, update_pck_entries, diff_packages, changed_hashes, MODE_NAMES, COPY_CHUNK_SIZE
 
-def process_single_bank_file(bank_file_path, numeric_ids):
-    found_offsets_in_file = {}
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Data alignment choices for repacked .pck files
+ALIGNMENT_OPTIONS = {"No alignment": 1, "Align 2048": 2048, "Align 4096": 4096}
+
+# ioctl request of FICLONE on Linux, shares the data blocks of two files on btrfs/xfs
+FICLONE = 0x40049409
+
+# Suffix of patch record files written instead of patched Banks copies
+PATCH_RECORD_SUFFIX = ".patch.json"
+
+# Watch mode polling interval
+WATCH_INTERVAL_MS = 1000
+
+# Marker that precedes the loop end (exit cue) position of a music segment
+LOOP_END_PATTERN = b'\x48\xd6\xbb\x5b'
+
+# An ID pair is the ID, 13 bytes and the ID again
+BANK_MATCH_SPAN = 4 + 13 + 4
+
+# Smallest byte range of a Banks file given to one scan worker
+BANK_SCAN_MIN_CHUNK = 16 << 20
 
+# Memory budget of the session cache of parsed packages and Banks scan results
+SESSION_CACHE_BUDGET = 256 << 20
+
+# Values written for one ID, in ms. loop_end defaults to the duration, loop_start is left untouched when None
+BankPatch = namedtuple('BankPatch', ('duration', 'loop_start', 'loop_end'), defaults=(None, None))
+
+def parse_id(id_val):
+    # IDs are decimal integers or 16-character hex strings
+    if len(id_val) == 16:
+        return int(id_val, 16)
+    return int(id_val)
+
+
+def parse_ids(text):
+    # Parse whitespace, comma or semicolon separated IDs in one batch, returns (ids, invalid values)
+    ids = []
+    invalid = []
+    for id_val in re.split(r'[\s,;]+', text):
+        if id_val:
+            try:
+                ids.append(parse_id(id_val))
+            except ValueError:
+                invalid.append(id_val)
+    return ids, invalid
+
+
+def load_manifest(manifest_path):
+    # The manifest is a JSON list of {"id": <ID>, "wem": <path relative to the manifest>}
+    # with optional "duration", "loop_start" and "loop_end" in ms
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        tracks = json.load(f)
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    manifest = []
+    for track in tracks:
+        entry = {"id": parse_id(str(track["id"])), "wem": os.path.join(base_dir, track["wem"])}
+        for key in ("duration", "loop_start", "loop_end"):
+            entry[key] = float(track[key]) if track.get(key) is not None else None
+        manifest.append(entry)
+    return manifest
+
+
+def file_signature(path):
     try:
-        with open(bank_file_path, 'rb') as f:
-            content = f.read()
-            
-        for numeric_id in numeric_ids:
-            id_bytes = struct.pack('<I', numeric_id)
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def scan_bank_range(bank_file_path, numeric_ids, start=0, end=None):
+    # Offsets of the ID pairs starting in [start, end), the search reads up to BANK_MATCH_SPAN - 1 bytes past end
+    found_offsets = {}
+    with open(bank_file_path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        end = size if end is None else min(end, size)
+        if start >= end:
+            return found_offsets
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as content:
+            limit = min(size, end + BANK_MATCH_SPAN - 1)
+            for numeric_id in numeric_ids:
+                id_bytes = struct.pack('<I', numeric_id)
+
+                pos = content.find(id_bytes, start, limit)
+                while pos != -1 and pos < end:
+                    check_pos = pos + 4 + 13
+                    if check_pos + 4 <= limit and content[check_pos:check_pos + 4] == id_bytes:
+                        found_offsets.setdefault(numeric_id, []).append(check_pos + 4)
+                    pos = content.find(id_bytes, pos + 1, limit)
+    return found_offsets
 
-            pos = -1
-            while True:
-                pos = content.find(id_bytes, pos + 1)
-                if pos == -1:
-                    break
-                
-                check_pos = pos + 4 + 13
-                if check_pos + 4 <= len(content) and content[check_pos:check_pos + 4] == id_bytes:
-                    end_offset = check_pos + 4
-                    if numeric_id not in found_offsets_in_file:
-                        found_offsets_in_file[numeric_id] = []
-                    found_offsets_in_file[numeric_id].append(end_offset)     
+
+def process_single_bank_file(bank_file_path, numeric_ids):
+    try:
+        found_offsets_in_file = scan_bank_range(bank_file_path, numeric_ids)
     except Exception as e:
         log(f"Error: processing {os.path.basename(bank_file_path)} failed: {e}")
         return bank_file_path, None
@@ -38,54 +119,345 @@ def process_single_bank_file(bank_file_path, numeric_ids):
     return bank_file_path, found_offsets_in_file
 
 
-def patch_bank_file(input_path, output_path, offsets, wem_duration_ms):
+def find_bank_files(banks_path):
+    return [f.path for f in os.scandir(banks_path) if re.match(r'Banks\d+\.pck$', f.name)]
+
+
+def scan_bank_files(bank_file_paths, numeric_ids):
+    # Yields (bank_file_path, offsets_dict) as each file finishes scanning
+    # Files are split into byte ranges sized from the total, so one large file does not leave the other workers idle
+    sizes = {}
+    for bank_file_path in bank_file_paths:
+        signature = file_signature(bank_file_path)
+        if signature is None:
+            log(f"Error: processing {os.path.basename(bank_file_path)} failed: file not found")
+            yield bank_file_path, None
+            continue
+        sizes[bank_file_path] = signature[1]
+
+    workers = os.cpu_count() or 1
+    if sys.platform == "win32":
+        # ProcessPoolExecutor on Windows accepts at most 61 workers
+        workers = min(workers, 61)
+    chunk_size = max(BANK_SCAN_MIN_CHUNK, -(-sum(sizes.values()) // (workers * 4)))
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        pending = {}
+        remaining = {}
+        results = {}
+        for bank_file_path, size in sizes.items():
+            starts = range(0, max(size, 1), chunk_size)
+            remaining[bank_file_path] = len(starts)
+            results[bank_file_path] = {}
+            for start in starts:
+                future = executor.submit(scan_bank_range, bank_file_path, numeric_ids, start, start + chunk_size)
+                pending[future] = bank_file_path
+
+        for future in concurrent.futures.as_completed(pending):
+            bank_file_path = pending[future]
+            if results[bank_file_path] is None:
+                continue
+            try:
+                for numeric_id, offsets in future.result().items():
+                    results[bank_file_path].setdefault(numeric_id, []).extend(offsets)
+            except Exception as e:
+                log(f"Error: processing {os.path.basename(bank_file_path)} failed: {e}")
+                results[bank_file_path] = None
+                yield bank_file_path, None
+                continue
+            remaining[bank_file_path] -= 1
+            if not remaining[bank_file_path]:
+                yield bank_file_path, {numeric_id: sorted(set(offsets))
+                                       for numeric_id, offsets in results.pop(bank_file_path).items()}
+
+
+def compute_bank_writes(f, offsets, patch_plan):
+    # Collect every (offset, bytes) write for all IDs of one Banks file in a single pass over a read-only map
+    writes = []
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as content:
+        for numeric_id, offsets_list in offsets.items():
+            patch = patch_plan[numeric_id]
+            duration_bytes = struct.pack('<d', patch.duration)
+            loop_end = patch.duration if patch.loop_end is None else patch.loop_end
+            for offset in offsets_list:
+                # 28 bytes zero followed by the 8 bytes of the duration
+                writes.append((offset, b'\x00' * 28 + duration_bytes))
+
+                # Find the first pattern after the patched bytes
+                pos = content.find(LOOP_END_PATTERN, offset + 36)
+                if pos == -1:
+                    log(f"Info: Pattern not found after offset {offset}")
+                    continue
+
+                # Loop end immediately after the pattern
+                writes.append((pos + len(LOOP_END_PATTERN), struct.pack('<d', loop_end)))
+
+                # Segment duration 28 bytes before the pattern, if possible
+                if pos - 28 >= 0:
+                    writes.append((pos - 28, duration_bytes))
+                else:
+                    log(f"Info: Cannot patch at negative offset for pattern found at {pos}")
+
+                # Loop start is the position of the entry cue right before the exit cue, which must have an empty name
+                if patch.loop_start is not None:
+                    if pos - 12 >= 0 and content[pos - 4:pos] == b'\x00' * 4:
+                        writes.append((pos - 12, struct.pack('<d', patch.loop_start)))
+                    else:
+                        log(f"Info: Entry cue not found before pattern at {pos}, loop start of ID {numeric_id} skipped")
+    writes.sort()
+    return writes
+
+
+def apply_bank_writes(f, writes):
+    for offset, data in writes:
+        f.seek(offset)
+        f.write(data)
+
+
+def clone_file(input_path, output_path):
+    # Reflink clone where the filesystem supports it, then copy_file_range, then a chunked copy
+    with open(input_path, 'rb') as src, open(output_path, 'wb') as dst:
+        if fcntl is not None:
+            try:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                return "reflink"
+            except OSError:
+                pass
+
+        if hasattr(os, 'copy_file_range'):
+            size = os.fstat(src.fileno()).st_size
+            copied = 0
+            try:
+                while copied < size:
+                    count = os.copy_file_range(src.fileno(), dst.fileno(), size - copied)
+                    if not count:
+                        break
+                    copied += count
+            except OSError:
+                pass
+            if copied == size:
+                return "copy_file_range"
+            src.seek(0)
+            dst.seek(0)
+            dst.truncate()
+
+        shutil.copyfileobj(src, dst, COPY_CHUNK_SIZE)
+        return "copy"
+
+
+def write_patched_copy(input_path, output_path, writes):
+    # Clone and patch next to the target first, the output may be the input file itself
+    temp_path = output_path + ".tmp"
+    try:
+        method = clone_file(input_path, temp_path)
+        with open(temp_path, 'r+b') as f:
+            apply_bank_writes(f, writes)
+        os.replace(temp_path, output_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return method
+
+
+def patch_record(input_path, offsets, writes):
+    # checks holds the ID pair behind every offset and the bytes every write replaces,
+    # apply_patch_record compares them so a bank rewritten in place at the same size is refused
+    positions = [(end - BANK_MATCH_SPAN, BANK_MATCH_SPAN) for found in offsets.values() for end in found]
+    positions += [(offset, len(data)) for offset, data in writes]
+    with open(input_path, 'rb') as f:
+        checks = []
+        for position, size in sorted(positions):
+            f.seek(position)
+            checks.append([position, f.read(size).hex()])
+        size = os.fstat(f.fileno()).st_size
+    return {
+        "bank": os.path.basename(input_path),
+        "size": size,
+        "checks": checks,
+        "writes": [[offset, data.hex()] for offset, data in writes],
+    }
+
+
+def write_patch_record(record_path, input_path, offsets, writes):
+    with open(record_path, 'w', encoding='utf-8') as f:
+        json.dump(patch_record(input_path, offsets, writes), f)
+
+
+def apply_patch_record(record_path, input_path, output_path):
+    with open(record_path, 'r', encoding='utf-8') as f:
+        record = json.load(f)
+    mismatch = ValueError(f"{os.path.basename(input_path)} does not match the bank recorded in {os.path.basename(record_path)}")
+    if os.path.getsize(input_path) != record["size"]:
+        raise mismatch
+    with open(input_path, 'rb') as f:
+        for position, data in record["checks"]:
+            f.seek(position)
+            if f.read(len(data) // 2).hex() != data:
+                raise mismatch
+    write_patched_copy(input_path, output_path, [(offset, bytes.fromhex(data)) for offset, data in record["writes"]])
+
+
+def patch_bank_file(input_path, output_path, offsets, patch_plan, as_record=False):
     try:
+        with open(input_path, 'rb') as f:
+            writes = compute_bank_writes(f, offsets, patch_plan)
+
+        if as_record:
+            # Only store the changed bytes, apply_patch_record rebuilds the patched bank
+            write_patch_record(output_path + PATCH_RECORD_SUFFIX, input_path, offsets, writes)
+            log(f"Info: Wrote patch record for {os.path.basename(input_path)} ({len(writes)} writes)")
+            return
+
         # Create a copy of the original file in the output folder
-        shutil.copyfile(input_path, output_path)
-        
-        # Prepare the binary data
-        zero_bytes = b'\x00' * 28
-        duration_bytes = struct.pack('<d', wem_duration_ms)
-        
-        # Search patterns
-        hex_pattern = b'\x48\xd6\xbb\x5b'
-
-        with open(output_path, 'r+b') as f:
-            for numeric_id, offsets_list in offsets.items():
-                for offset in offsets_list:
-                    # Move the file pointer at the beginning of the 32 bytes to zero
-                    f.seek(offset)
-
-                    # Writing the 32 bytes zero
-                    f.write(zero_bytes)
-                    
-                    # Write the 8 bytes of the duration
-                    f.write(duration_bytes)
-                    f.seek(offset)
-                    content = f.read()
-
-                    # Find the first pattern after the offset
-                    pos_in_content = content.find(hex_pattern)
-                    if pos_in_content != -1:
-                        pos = offset + pos_in_content  # Absolute position in the file
-
-                        # Patch immediately after the pattern
-                        f.seek(pos + len(hex_pattern))
-                        f.write(duration_bytes)
-
-                        # Patch 28 byte before the pattern, if possible
-                        if pos - 28 >= 0:
-                            f.seek(pos - 28)
-                            f.write(duration_bytes)
-                        else:
-                            log(f"Info: Cannot patch at negative offset for pattern found at {pos}")
-                    else:
-                        log(f"Info: Pattern not found after offset {offset}")
-        log(f"Info: Patched {os.path.basename(input_path)} successfully")
+        method = write_patched_copy(input_path, output_path, writes)
+        log(f"Info: Patched {os.path.basename(input_path)} successfully ({method})")
     except Exception as e:
         log(f"Error: Failed to patch {os.path.basename(input_path)}: {e}")
 
 
+def load_packages(pck_paths):
+    package = Package()
+    try:
+        for pck_path in pck_paths:
+            package.addfile(pck_path)
+    except Exception:
+        package.close()
+        raise
+    return package
+
+
+def repack_pck_file(pck_path, output_pck_path, replacements, alignment=1, cache=None):
+    # Returns ({id: wem} of the replaced IDs, alignment padding), nothing is written when no ID is in the pck
+    package = cache.package(pck_path) if cache is not None else load_packages([pck_path])
+    try:
+        lang_map = package.map[1].get(0, {})
+        replaced = {}
+        for numeric_id, wem_file in replacements.items():
+            if numeric_id in lang_map:
+                package.add_wem(1, 0, numeric_id, wem_file)
+                log(f"Info: Replaced WEM with ID {numeric_id}")
+                replaced[numeric_id] = wem_file
+            else:
+                log(f"Info: ID {numeric_id} not found in {os.path.basename(pck_path)}, skipped")
+        if not replaced:
+            return replaced, 0
+
+        # Write next to the target first, the source pck may be the target itself
+        temp_pck_path = output_pck_path + ".tmp"
+        try:
+            with open(temp_pck_path, 'wb') as output_stream:
+                padding = build_pck_file(package, output_stream, package.LANGUAGE_DEF, alignment=alignment)
+        except BaseException:
+            if os.path.exists(temp_pck_path):
+                os.remove(temp_pck_path)
+            raise
+    finally:
+        package.close()
+    os.replace(temp_pck_path, output_pck_path)
+    return replaced, padding
+
+
+def build_patch_plan(replacements, tracks, entry_duration=None):
+    # Duration and loop points of every ID: manifest values first, then entry_duration, then the .wem length
+    manifest_tracks = {track["id"]: track for track in tracks}
+    probed = {}
+    patch_plan = {}
+    for numeric_id, wem_file in replacements.items():
+        track = manifest_tracks.get(numeric_id)
+        if track is None or track["wem"] != wem_file:
+            # Typed in the GUI, the length entry applies
+            track = {}
+        duration = track.get("duration")
+        if duration is None and not track:
+            duration = entry_duration
+        if duration is None:
+            if wem_file not in probed:
+                log(f"Info: Could not determine the duration of ID {numeric_id}. Using Wem Length")
+                probed[wem_file] = get_wem_duration(wem_file)
+                if probed[wem_file] is not None:
+                    log(f"Info: {os.path.basename(wem_file)} Length = {probed[wem_file]}")
+            duration = probed[wem_file]
+            if duration is None:
+                raise ValueError(f"An error occurred while getting WEM duration of ID {numeric_id}")
+        patch_plan[numeric_id] = BankPatch(duration, track.get("loop_start"), track.get("loop_end"))
+    return patch_plan
+
+
+class SessionCache:
+    # Parsed packages and Banks scan results of one session, an entry is dropped when the stat of its file changes
+    # Least recently used entries are evicted while the estimated size is over budget
+    def __init__(self, budget=SESSION_CACHE_BUDGET):
+        self.budget = budget
+        self.nbytes = 0
+        self._entries = OrderedDict()
+
+    def _get(self, key, signature):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if signature is None or entry[0] != signature:
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def _put(self, key, signature, value, nbytes):
+        self._drop(key)
+        if signature is None or nbytes > self.budget:
+            return
+        self._entries[key] = (signature, value, nbytes)
+        self.nbytes += nbytes
+        while self.nbytes > self.budget:
+            self._drop(next(iter(self._entries)))
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.nbytes -= entry[2]
+
+    def package(self, pck_path):
+        # Returns a copy of the cached tables, the caller may add files to it and must close it
+        key = ("package", os.path.abspath(pck_path))
+        signature = file_signature(pck_path)
+        template = self._get(key, signature)
+        if template is None:
+            package = load_packages([pck_path])
+            try:
+                # The template never reads, so it holds no open files
+                template = package.copy()
+            finally:
+                package.close()
+            self._put(key, signature, template, template.nbytes)
+        return template.copy()
+
+    def scan_banks(self, bank_file_paths, numeric_ids):
+        # Same results as scan_bank_files, each file is only scanned for the IDs it was not scanned for yet
+        numeric_ids = set(numeric_ids)
+        pending = {}
+        for bank_file_path in bank_file_paths:
+            key = ("scan", os.path.abspath(bank_file_path))
+            signature = file_signature(bank_file_path)
+            scanned_ids, offsets = self._get(key, signature) or (frozenset(), {})
+            missing = frozenset(numeric_ids - scanned_ids)
+            if missing:
+                pending.setdefault(missing, []).append((bank_file_path, key, signature, scanned_ids, offsets))
+            else:
+                yield bank_file_path, {numeric_id: found for numeric_id, found in offsets.items() if numeric_id in numeric_ids}
+
+        for missing, files in pending.items():
+            files = {bank_file_path: rest for bank_file_path, *rest in files}
+            for bank_file_path, offsets_dict in scan_bank_files(list(files), list(missing)):
+                if offsets_dict is None:
+                    yield bank_file_path, None
+                    continue
+                key, signature, scanned_ids, offsets = files[bank_file_path]
+                offsets = {**offsets, **offsets_dict}
+                scanned_ids = scanned_ids | missing
+                nbytes = 64 * (len(scanned_ids) + sum(len(found) for found in offsets.values()))
+                self._put(key, signature, (scanned_ids, offsets), nbytes)
+                yield bank_file_path, {numeric_id: found for numeric_id, found in offsets.items() if numeric_id in numeric_ids}
+
+
 def get_wem_duration(wem_path):
     try:
         with open(wem_path, 'rb') as f:
@@ -109,6 +481,7 @@ def get_wem_duration(wem_path):
 
 _logger_widget = None
 _logger_buffer = []
+_logger_console = False
 
 def set_logger_widget(widget):
     global _logger_widget, _logger_buffer
@@ -121,9 +494,16 @@ def set_logger_widget(widget):
     _logger_buffer = []
 
 
+def set_logger_console():
+    global _logger_console
+    _logger_console = True
+
+
 def log(message):
     global _logger_widget, _logger_buffer
-    if _logger_widget:
+    if _logger_console:
+        print(message)
+    elif _logger_widget:
         _logger_widget.configure(state="normal")
         _logger_widget.insert("end", message + "\n")
         _logger_widget.see("end")
@@ -131,6 +511,97 @@ def log(message):
     else:
         _logger_buffer.append(message)
 
+class IdListView(customtkinter.CTkFrame):
+    # Only a fixed number of rows exist, scrolling just changes the text they show
+    def __init__(self, master, rows, on_remove, **kwargs):
+        super().__init__(master, **kwargs)
+        self.rows = rows
+        self.on_remove = on_remove
+        self.items = []
+        self.first = 0
+
+        self.scrollbar = customtkinter.CTkScrollbar(self, command=self.on_scrollbar)
+        self.scrollbar.pack(side="right", fill="y")
+
+        body = customtkinter.CTkFrame(self, fg_color="transparent")
+        body.pack(side="left", expand=True, fill="both")
+
+        self.row_widgets = []
+        for i in range(rows):
+            row = customtkinter.CTkFrame(body, fg_color="transparent")
+            row.pack(fill="x", pady=1, padx=5)
+
+            label = customtkinter.CTkLabel(row, text="", anchor="w", height=20)
+            label.pack(side="left", expand=True, fill="x", padx=(0, 5))
+
+            remove_button = customtkinter.CTkButton(
+                row,
+                text="X",
+                command=lambda i=i: self.remove_row(i),
+                fg_color="#6e0000",
+                hover_color="#4d0000",
+                width=30,
+                height=20,
+            )
+            remove_button.pack(side="right")
+            self.row_widgets.append((label, remove_button))
+
+            for widget in (row, label):
+                widget.bind("<MouseWheel>", self.on_mousewheel)
+                widget.bind("<Button-4>", self.on_mousewheel)
+                widget.bind("<Button-5>", self.on_mousewheel)
+        self.render()
+
+
+    def set_items(self, items):
+        # items is a list of (numeric_id, text)
+        self.items = items
+        self.scroll_to(self.first)
+
+
+    def scroll_to(self, first):
+        self.first = max(0, min(first, len(self.items) - self.rows))
+        self.render()
+
+
+    def render(self):
+        for i, (label, remove_button) in enumerate(self.row_widgets):
+            index = self.first + i
+            if index < len(self.items):
+                label.configure(text=self.items[index][1])
+                remove_button.configure(state="normal", text="X")
+            else:
+                label.configure(text="")
+                remove_button.configure(state="disabled", text="")
+
+        total = len(self.items)
+        if total <= self.rows:
+            self.scrollbar.set(0, 1)
+        else:
+            self.scrollbar.set(self.first / total, (self.first + self.rows) / total)
+
+
+    def on_scrollbar(self, action, amount, unit=None):
+        if action == "moveto":
+            self.scroll_to(int(float(amount) * len(self.items)))
+        else:
+            step = self.rows if unit == "pages" else 1
+            self.scroll_to(self.first + int(amount) * step)
+
+
+    def on_mousewheel(self, event):
+        if getattr(event, "num", None) == 4 or getattr(event, "delta", 0) > 0:
+            self.scroll_to(self.first - 3)
+        else:
+            self.scroll_to(self.first + 3)
+
+
+    def remove_row(self, i):
+        index = self.first + i
+        if index < len(self.items):
+            self.on_remove(self.items[index][0])
+
+
 customtkinter.set_appearance_mode("Dark")
 customtkinter.set_default_color_theme("dark-blue")
 
@@ -139,14 +610,23 @@ class App(customtkinter.CTk):
         super().__init__()
 
         self.title("GI Music Replacer")
-        self.geometry("600x800")
+        self.geometry("600x920")
         self.resizable(False, False)
         self.pck_files = []
         self.wem_file = ""
         self.output_folder = ""
-        self.id_entries = []
+        self.id_list = []
+        self.id_locations = {}
         self.numeric_ids = []
         self.banks_path = ""
+        self.manifest_path = ""
+        self.manifest = []
+        self.last_outputs = {}
+        self.last_bank_patches = {}
+        self.watching = False
+        self.watch_stats = {}
+        self.watch_pending = {}
+        self.session_cache = SessionCache()
 
         if getattr(sys, 'frozen', False):
             base_path = os.path.dirname(sys.executable)
@@ -225,6 +705,16 @@ class App(customtkinter.CTk):
         )
         self.banks_label.pack(side="left", expand=True, fill="x")
 
+        self.patch_record_checkbox = customtkinter.CTkCheckBox(
+            top_banks,
+            text="Patch records only",
+            text_color="#ffffff",
+            fg_color="#ff0000",
+            hover_color="#cc0000",
+            font=("Arial", 12, "bold")
+        )
+        self.patch_record_checkbox.pack(side="right")
+
         wem_frame = customtkinter.CTkFrame(self, fg_color="black", corner_radius=5)
         wem_frame.pack(pady=5, padx=20, fill="x")
 
@@ -255,6 +745,29 @@ class App(customtkinter.CTk):
         )
         self.wem_label.pack(side="left", expand=True, fill="x")
 
+        manifest_row = customtkinter.CTkFrame(wem_frame, fg_color="transparent")
+        manifest_row.pack(fill="x", padx=10, pady=(0, 3))
+
+        self.manifest_button = customtkinter.CTkButton(
+            manifest_row,
+            text="Load Manifest",
+            command=self.select_manifest_file,
+            fg_color=button_color,
+            hover_color=button_hover,
+            height=25,
+            font=header_font
+        )
+        self.manifest_button.pack(side="left", padx=(0, 10))
+
+        self.manifest_label = customtkinter.CTkLabel(
+            manifest_row,
+            text="No manifest loaded",
+            justify="left",
+            text_color=header_text,
+            font=header_font
+        )
+        self.manifest_label.pack(side="left", expand=True, fill="x")
+
         dur_frame = customtkinter.CTkFrame(wem_frame, fg_color="transparent")
         dur_frame.pack(fill="x", padx=10, pady=(0, 3))
 
@@ -265,7 +778,7 @@ class App(customtkinter.CTk):
         self.wem_duration_entry = customtkinter.CTkEntry(dur_frame, width=150, height=25)
         self.wem_duration_entry.pack(side="left", expand=True, fill="x")
 
-        self.id_main_frame = customtkinter.CTkFrame(self, fg_color="black", corner_radius=5)
+        self.id_main_frame = customtkinter.CTkFrame(self, fg_color="black", corner_radius=5, height=250)
         self.id_main_frame.pack(pady=5, padx=20, fill="x")
         self.id_main_frame.pack_propagate(False)
 
@@ -276,23 +789,63 @@ class App(customtkinter.CTk):
             id_header_frame, text="IDs to replace:", text_color=header_text, font=("Arial", 14, "bold")
         ).pack(side="left")
 
-        add_id_button = customtkinter.CTkButton(
-            id_header_frame,
+        self.id_count_label = customtkinter.CTkLabel(
+            id_header_frame, text="0 IDs", text_color=header_text, font=header_font
+        )
+        self.id_count_label.pack(side="left", padx=10)
+
+        for text, command in (("Clear", self.clear_ids), ("Import", self.import_ids), ("Paste", self.paste_ids)):
+            customtkinter.CTkButton(
+                id_header_frame,
+                text=text,
+                command=command,
+                fg_color=button_color,
+                hover_color=button_hover,
+                width=60,
+                height=20,
+                font=header_font
+            ).pack(side="right", padx=(5, 0))
+
+        id_input_frame = customtkinter.CTkFrame(self.id_main_frame, fg_color="transparent")
+        id_input_frame.pack(fill="x", padx=10, pady=(3, 0))
+
+        self.id_input_entry = customtkinter.CTkEntry(
+            id_input_frame, height=25, placeholder_text="IDs separated by spaces or commas"
+        )
+        self.id_input_entry.pack(side="left", expand=True, fill="x", padx=(0, 5))
+        self.id_input_entry.bind("<Return>", lambda event: self.add_typed_ids())
+
+        customtkinter.CTkButton(
+            id_input_frame,
             text="Add ID",
-            command=self.add_id_entry,
+            command=self.add_typed_ids,
             fg_color=button_color,
             hover_color=button_hover,
             width=70,
-            height=20,
+            height=25,
             font=header_font
-        )
-        add_id_button.pack(side="right")
+        ).pack(side="right")
 
-        self.id_entries_frame = customtkinter.CTkScrollableFrame(
-            self.id_main_frame, height=80, fg_color="transparent"
-        )
-        self.id_entries_frame.pack(pady=3, fill="x", padx=10)
-        self.add_id_entry()
+        id_search_frame = customtkinter.CTkFrame(self.id_main_frame, fg_color="transparent")
+        id_search_frame.pack(fill="x", padx=10, pady=(3, 0))
+
+        self.id_search_entry = customtkinter.CTkEntry(id_search_frame, height=25, placeholder_text="Search")
+        self.id_search_entry.pack(side="left", expand=True, fill="x", padx=(0, 5))
+        self.id_search_entry.bind("<KeyRelease>", lambda event: self.refresh_id_list())
+
+        customtkinter.CTkButton(
+            id_search_frame,
+            text="Find in Packs",
+            command=self.find_ids_in_packs,
+            fg_color=button_color,
+            hover_color=button_hover,
+            width=110,
+            height=25,
+            font=header_font
+        ).pack(side="right")
+
+        self.id_list_view = IdListView(self.id_main_frame, 5, self.remove_id, fg_color="transparent")
+        self.id_list_view.pack(pady=3, fill="both", expand=True, padx=10)
 
         output_frame = customtkinter.CTkFrame(self, fg_color="black", corner_radius=5)
         output_frame.pack(pady=5, padx=20, fill="x")
@@ -324,6 +877,18 @@ class App(customtkinter.CTk):
         )
         self.output_label.pack(side="left", expand=True, fill="x")
 
+        self.alignment_menu = customtkinter.CTkOptionMenu(
+            top_output,
+            values=list(ALIGNMENT_OPTIONS),
+            fg_color=button_color,
+            button_color=button_color,
+            button_hover_color=button_hover,
+            width=120,
+            height=25,
+            font=header_font
+        )
+        self.alignment_menu.pack(side="right", padx=(10, 0))
+
         button_frame = customtkinter.CTkFrame(self, fg_color="black", corner_radius=5, height=55)
         button_frame.pack(pady=10, padx=20, fill="x")
         button_frame.pack_propagate(False) 
@@ -349,7 +914,31 @@ class App(customtkinter.CTk):
             height=35,
             font=header_font
         )
-        self.patch_banks_button.pack(side="left", expand=True, fill="x", padx=(5, 10))
+        self.patch_banks_button.pack(side="left", expand=True, fill="x", padx=5)
+
+        self.dry_run_button = customtkinter.CTkButton(
+            button_frame,
+            text="Dry Run",
+            command=self.plan_changes,
+            fg_color=button_color,
+            hover_color=button_hover,
+            width=90,
+            height=35,
+            font=header_font
+        )
+        self.dry_run_button.pack(side="left", padx=5)
+
+        self.watch_button = customtkinter.CTkButton(
+            button_frame,
+            text="Watch",
+            command=self.toggle_watch,
+            fg_color=button_color,
+            hover_color=button_hover,
+            width=90,
+            height=35,
+            font=header_font
+        )
+        self.watch_button.pack(side="left", padx=(5, 10))
 
         self.patch_banks_textbox = customtkinter.CTkTextbox(
             self,
@@ -365,30 +954,111 @@ class App(customtkinter.CTk):
         set_logger_widget(self.patch_banks_textbox)
 
 
-    def add_id_entry(self):
-        frame = customtkinter.CTkFrame(self.id_entries_frame)
-        frame.pack(fill="x", pady=1, padx=5)
+    def id_items(self):
+        # Manifest IDs use their own .wem, IDs added here use the selected .wem and win over the manifest
+        items = {track["id"]: os.path.basename(track["wem"]) for track in self.manifest}
+        for numeric_id in self.id_list:
+            items[numeric_id] = "selected .wem"
+        return items
+
+
+    def refresh_id_list(self):
+        search = self.id_search_entry.get().strip().lower()
+        all_items = self.id_items()
+        rows = []
+        for numeric_id, source in all_items.items():
+            text = f"{numeric_id}  ({numeric_id:016x})  {source}"
+            if numeric_id in self.id_locations:
+                text += "  ->  " + (", ".join(self.id_locations[numeric_id]) or "not in packs")
+            if not search or search in text.lower():
+                rows.append((numeric_id, text))
+        self.id_list_view.set_items(rows)
+        if search:
+            self.id_count_label.configure(text=f"{len(rows)} of {len(all_items)} IDs")
+        else:
+            self.id_count_label.configure(text=f"{len(all_items)} IDs")
 
-        entry = customtkinter.CTkEntry(frame, width=300, height=25)
-        entry.pack(side="left", expand=True, fill="x", padx=(0, 5))
-        
-        remove_button = customtkinter.CTkButton(
-            frame,
-            text="X",
-            command=lambda: self.remove_id_entry(frame, entry),
-            fg_color="#6e0000",
-            hover_color="#4d0000",
-            width=30,
-            height=20,
+
+    def add_ids(self, text):
+        ids, invalid = parse_ids(text)
+        known = set(self.id_list)
+        added = 0
+        for numeric_id in ids:
+            if numeric_id not in known:
+                known.add(numeric_id)
+                self.id_list.append(numeric_id)
+                added += 1
+        if invalid:
+            shown = ", ".join(f"'{id_val}'" for id_val in invalid[:10]) + (" ..." if len(invalid) > 10 else "")
+            messagebox.showerror("Error", f"Invalid ID(s): {shown}. All IDs must be valid integers or 16-character hex strings")
+            log(f"Invalid ID(s): {shown}. All IDs must be valid integers or 16-character hex strings")
+        if added:
+            log(f"Info: Added {added} IDs")
+        self.refresh_id_list()
+
+
+    def add_typed_ids(self):
+        self.add_ids(self.id_input_entry.get())
+        self.id_input_entry.delete(0, "end")
+
+
+    def paste_ids(self):
+        try:
+            self.add_ids(self.clipboard_get())
+        except Exception:
+            log("Info: Clipboard is empty")
+
+
+    def import_ids(self):
+        file = filedialog.askopenfilename(
+            title="Select ID list",
+            filetypes=[("Text files", "*.txt *.csv"), ("All files", "*.*")]
         )
-        remove_button.pack(side="right")
+        if file:
+            with open(file, 'r', encoding='utf-8') as f:
+                self.add_ids(f.read())
+
+
+    def clear_ids(self):
+        self.id_list = []
+        self.refresh_id_list()
+
+
+    def remove_id(self, numeric_id):
+        if numeric_id in self.id_list:
+            self.id_list.remove(numeric_id)
+        else:
+            self.manifest = [track for track in self.manifest if track["id"] != numeric_id]
+        self.refresh_id_list()
+
 
-        self.id_entries.append(entry)
+    def find_ids_in_packs(self):
+        if not self.pck_files:
+            messagebox.showerror("Error", "Please select at least one .pck file")
+            log("Error: Please select at least one .pck file")
+            return
 
+        numeric_ids = list(self.id_items())
+        self.id_locations = {numeric_id: [] for numeric_id in numeric_ids}
+        for pck_path in self.pck_files:
+            try:
+                package = self.session_cache.package(pck_path)
+            except Exception as e:
+                log(f"Error: Failed to read {os.path.basename(pck_path)}: {e}")
+                continue
+            try:
+                lang_map = package.map[1].get(0, {})
+                for numeric_id in numeric_ids:
+                    if numeric_id in lang_map:
+                        self.id_locations[numeric_id].append(os.path.basename(pck_path))
+            except Exception as e:
+                log(f"Error: Failed to read {os.path.basename(pck_path)}: {e}")
+            finally:
+                package.close()
 
-    def remove_id_entry(self, frame, entry):
-        self.id_entries.remove(entry)
-        frame.destroy()
+        not_found = sum(1 for locations in self.id_locations.values() if not locations)
+        log(f"Info: {len(numeric_ids) - not_found} IDs found in the selected packs, {not_found} not found")
+        self.refresh_id_list()
 
 
     def select_pck_files(self):
@@ -427,6 +1097,29 @@ class App(customtkinter.CTk):
             self.wem_label.configure(text="No .wem file selected")
 
 
+    def select_manifest_file(self):
+        file = filedialog.askopenfilename(
+            title="Select manifest file",
+            filetypes=[("Manifest files", "*.json")]
+        )
+        if not file:
+            self.manifest_path = ""
+            self.manifest = []
+            self.manifest_label.configure(text="No manifest loaded")
+            self.refresh_id_list()
+            return
+        try:
+            self.manifest = load_manifest(file)
+        except Exception as e:
+            messagebox.showerror("Error", f"Invalid manifest: {e}")
+            log(f"Error: Invalid manifest {os.path.basename(file)}: {e}")
+            return
+        self.manifest_path = file
+        self.manifest_label.configure(text=f"Manifest: {os.path.basename(file)} ({len(self.manifest)} tracks)")
+        log(f"Info: Loaded {len(self.manifest)} tracks from {os.path.basename(file)}")
+        self.refresh_id_list()
+
+
     def select_output_folder(self):
         folder = filedialog.askdirectory(title="Select Output Folder")
         if folder:
@@ -453,30 +1146,15 @@ class App(customtkinter.CTk):
                                              "File names must be in the format 'Music[number].pck', e.g., Music0.pck")
                 return
 
-        if not self.wem_file:
-            messagebox.showerror("Error", "Please select a .wem file")
-            log("Error: Please select a .wem file")
+        replacements = self.collect_replacements(require_wem=True)
+        if replacements is None:
             return
-        
-        self.numeric_ids = []
-        for entry in self.id_entries:
-            id_val = entry.get().strip()
-            if id_val:
-                try:
-                    if len(id_val) == 16:
-                        converted_id = int(id_val, 16)
-                    else:
-                        converted_id = int(id_val)
-                    self.numeric_ids.append(converted_id)
-                except ValueError:
-                    messagebox.showerror("Error", f"Invalid ID: '{id_val}'. All IDs must be valid integers or 16-character hex strings")
-                    log(f"Invalid ID: '{id_val}'. All IDs must be valid integers or 16-character hex strings")
-                    return
 
-        if not self.numeric_ids:
-            messagebox.showerror("Error", "Please enter at least one numeric ID")
-            log("Please enter at least one numeric ID")
+        if not replacements:
+            messagebox.showerror("Error", "Please enter at least one numeric ID or load a manifest")
+            log("Please enter at least one numeric ID or load a manifest")
             return
+        self.numeric_ids = list(replacements)
 
         if self.output_folder:
             output_dir = self.output_folder
@@ -487,42 +1165,23 @@ class App(customtkinter.CTk):
                 log(f"Info: No output folder selected. Using default: {output_dir}")
         log("Info: Starting Repacking...")
         
-        wem_data = None
-        try:
-            with open(self.wem_file, 'rb') as wem_stream:
-                wem_data = wem_stream.read()
-        except FileNotFoundError:
-            messagebox.showerror("Error", "Selected .wem file not found")
-            log("Error: Selected .wem file not found")
-            return
+        for wem_path in set(replacements.values()):
+            if not os.path.isfile(wem_path):
+                messagebox.showerror("Error", f".wem file not found: {wem_path}")
+                log(f"Error: .wem file not found: {wem_path}")
+                return
 
+        self.last_outputs = {}
         pck_count = len(self.pck_files)
         for i, pck_path in enumerate(self.pck_files):
             try:
-                modified_pck_package = Package()
-                with open(pck_path, 'rb') as pck_stream:
-                    modified_pck_package.addfile(BufferedReader(BytesIO(pck_stream.read())))
-
-                replaced_count = 0
-                mode = 1
-                lang_id = 0
-                hash_map = modified_pck_package.map[mode]
-                lang_map = hash_map.get(lang_id)
-
-                for numeric_id in self.numeric_ids:
-                    if numeric_id in lang_map:
-                        new_wem_buffer = BufferedReader(BytesIO(wem_data))
-                        modified_pck_package.add_wem(mode, lang_id, numeric_id, new_wem_buffer)
-                        log(f"Info: Replaced WEM with ID {numeric_id}")
-                        replaced_count += 1
-                    else:
-                        log(f"Info: ID {numeric_id} not found in {os.path.basename(pck_path)}, skipped")
-
-                if replaced_count > 0:
-                    output_pck_path = os.path.join(output_dir, os.path.basename(pck_path))
-                    with open(output_pck_path, 'wb') as output_stream:
-                        build_pck_file(modified_pck_package, output_stream, modified_pck_package.LANGUAGE_DEF)
-                    log(f"Info: Repacked {os.path.basename(pck_path)} ({i + 1}/{pck_count})")
+                output_pck_path = os.path.join(output_dir, os.path.basename(pck_path))
+                replaced, padding = repack_pck_file(pck_path, output_pck_path,
+                                                    {numeric_id: replacements[numeric_id] for numeric_id in self.numeric_ids},
+                                                    ALIGNMENT_OPTIONS[self.alignment_menu.get()], self.session_cache)
+                if replaced:
+                    self.last_outputs[output_pck_path] = replaced
+                    log(f"Info: Repacked {os.path.basename(pck_path)} ({i + 1}/{pck_count}), {padding} bytes of alignment padding")
                 else:
                     log(f"Info: No IDs were replaced in {os.path.basename(pck_path)}. Skipping save")
             except Exception as e:
@@ -532,21 +1191,11 @@ class App(customtkinter.CTk):
         log("Info: Repacking complete! You can now Patch the Banks files")
 
     def patch_banks(self):
-        self.numeric_ids = []
-        for entry in self.id_entries:
-            id_val = entry.get().strip()
-            if id_val:
-                try:
-                    if len(id_val) == 16:
-                        converted_id = int(id_val, 16)
-                    else:
-                        converted_id = int(id_val)
-                    self.numeric_ids.append(converted_id)
-                except ValueError:
-                    messagebox.showerror("Error", f"Invalid ID: '{id_val}'. All IDs must be valid integers or 16-character hex strings")
-                    log(f"Invalid ID: '{id_val}'. All IDs must be valid integers or 16-character hex strings")
-                    return
-    
+        replacements = self.collect_replacements(require_wem=False)
+        if replacements is None:
+            return
+        self.numeric_ids = list(replacements)
+
         if not self.numeric_ids:
             messagebox.showerror("Error", "Please process files first to get a list of IDs")
             log("Error: Please process files first to get a list of IDs")
@@ -561,20 +1210,10 @@ class App(customtkinter.CTk):
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
 
-        wem_duration_str = self.wem_duration_entry.get().strip()
-        try:
-            wem_duration = float(wem_duration_str)
-        except ValueError:
-            log("Info: Could not determine the WEM file's duration. Using Wem Length")
-            wem_duration = get_wem_duration(self.wem_file)
-            if wem_duration is None:
-                messagebox.showerror("Error", "An error occurred while getting WEM duration")
-                return
-            log(f"Info: Wem Length = {wem_duration}")
-        except Exception as e:
-            messagebox.showerror("Error", f"An error occurred while getting WEM duration: {e}")
-            log(f"Error: An error occurred while getting WEM duration: {e}")
+        patch_plan = self.build_patch_plan(replacements)
+        if patch_plan is None:
             return
+        self.last_bank_patches = {}
 
         found_ids = set()
         not_found_ids = set(self.numeric_ids)
@@ -582,31 +1221,26 @@ class App(customtkinter.CTk):
         
         log("Info: Starting Banks patching...")
         
-        banks_files = [f for f in os.scandir(self.banks_path) if re.match(r'Banks\d+\.pck$', f.name)]
+        banks_file_paths = find_bank_files(self.banks_path)
 
-        if not banks_files:
+        if not banks_file_paths:
             log("Info: No BanksX.pck files found to patch")
             return
-        
-        banks_file_paths = [f.path for f in banks_files]
 
-        with concurrent.futures.ProcessPoolExecutor() as executor:
-            results = executor.map(process_single_bank_file, 
-                                   banks_file_paths,
-                                   [self.numeric_ids] * len(banks_file_paths))
-            
-            for bank_file_path, offsets_dict in results:
-                if offsets_dict:
-                    file_name = os.path.basename(bank_file_path)
-                    files_with_couples.append(file_name)
-                    
-                    output_file_path = os.path.join(output_dir, file_name)
-                    patch_bank_file(bank_file_path, output_file_path, offsets_dict, wem_duration)
-                    
-                    for id_val, offsets in offsets_dict.items():
-                        found_ids.add(id_val)
-                        if id_val in not_found_ids:
-                            not_found_ids.remove(id_val)
+        for bank_file_path, offsets_dict in self.session_cache.scan_banks(banks_file_paths, self.numeric_ids):
+            if offsets_dict:
+                file_name = os.path.basename(bank_file_path)
+                files_with_couples.append(file_name)
+
+                output_file_path = os.path.join(output_dir, file_name)
+                as_record = bool(self.patch_record_checkbox.get())
+                patch_bank_file(bank_file_path, output_file_path, offsets_dict, patch_plan, as_record)
+                self.last_bank_patches[bank_file_path] = (output_file_path, offsets_dict, as_record)
+
+                for id_val, offsets in offsets_dict.items():
+                    found_ids.add(id_val)
+                    if id_val in not_found_ids:
+                        not_found_ids.remove(id_val)
 
         result_text = "Info: Patching complete.\n\n"
         if found_ids:
@@ -628,6 +1262,411 @@ class App(customtkinter.CTk):
             
         log(result_text)
 
+
+    def plan_changes(self):
+        # Compute what Repack and Patch would do without writing any .pck or Banks file
+        replacements = self.collect_replacements(require_wem=True)
+        if replacements is None:
+            return
+
+        if not replacements:
+            messagebox.showerror("Error", "Please enter at least one numeric ID or load a manifest")
+            log("Please enter at least one numeric ID or load a manifest")
+            return
+
+        output_dir = self.output_folder if self.output_folder else os.path.join(os.path.dirname(__file__), "output_pck")
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+
+        log("Info: Starting dry run...")
+        alignment = ALIGNMENT_OPTIONS[self.alignment_menu.get()]
+        plan = {"alignment": alignment, "packs": [], "banks": []}
+        read_bytes = 0
+        write_bytes = 0
+        found_ids = set()
+
+        for pck_path in self.pck_files:
+            try:
+                package = self.session_cache.package(pck_path)
+            except Exception as e:
+                log(f"Error: Failed to plan {os.path.basename(pck_path)}: {e}")
+                continue
+            try:
+                lang_map = package.map[1].get(0, {})
+                pck_ids = [numeric_id for numeric_id in replacements if numeric_id in lang_map]
+                for numeric_id in pck_ids:
+                    package.add_wem(1, 0, numeric_id, replacements[numeric_id])
+                summary = summarize_pck_plan(package, plan_pck_file(package, package.LANGUAGE_DEF, alignment))
+            except Exception as e:
+                log(f"Error: Failed to plan {os.path.basename(pck_path)}: {e}")
+                continue
+            finally:
+                package.close()
+
+            summary["pck"] = pck_path
+            summary["ids"] = pck_ids
+            summary["output"] = os.path.join(output_dir, os.path.basename(pck_path)) if pck_ids else None
+            plan["packs"].append(summary)
+            if pck_ids:
+                found_ids.update(pck_ids)
+                read_bytes += summary["table_bytes"] + summary["original_bytes"] + summary["replaced_bytes"]
+                write_bytes += summary["size"]
+
+        if self.banks_path and os.path.exists(self.banks_path):
+            patch_plan = self.build_patch_plan(replacements)
+            as_record = bool(self.patch_record_checkbox.get())
+            banks_file_paths = find_bank_files(self.banks_path)
+            for bank_file_path, offsets_dict in self.session_cache.scan_banks(banks_file_paths, list(replacements)):
+                bank_size = os.path.getsize(bank_file_path)
+                read_bytes += bank_size
+                if not offsets_dict:
+                    continue
+                found_ids.update(offsets_dict)
+                output_path = os.path.join(output_dir, os.path.basename(bank_file_path))
+                bank = {
+                    "bank": bank_file_path,
+                    "output": output_path + PATCH_RECORD_SUFFIX if as_record else output_path,
+                    "mode": "record" if as_record else "copy",
+                    "size": bank_size,
+                    "offsets": {str(numeric_id): offsets for numeric_id, offsets in offsets_dict.items()},
+                }
+                writes = []
+                if patch_plan is not None:
+                    bank["patches"] = {str(numeric_id): patch_plan[numeric_id]._asdict() for numeric_id in offsets_dict}
+                    with open(bank_file_path, 'rb') as f:
+                        writes = compute_bank_writes(f, offsets_dict, patch_plan)
+                bank["patch_bytes"] = sum(len(data) for _, data in writes)
+                if as_record:
+                    # Only the patched bytes are read, the record is all that is written
+                    read_bytes += bank["patch_bytes"]
+                    bank["write_bytes"] = len(json.dumps(patch_record(bank_file_path, offsets_dict, writes)))
+                else:
+                    # Upper bound, a reflink clone only writes the patched blocks
+                    read_bytes += bank_size
+                    bank["write_bytes"] = bank_size + bank["patch_bytes"]
+                write_bytes += bank["write_bytes"]
+                plan["banks"].append(bank)
+
+        plan["not_found_ids"] = sorted(set(replacements) - found_ids)
+        plan["io"] = {"read_bytes": read_bytes, "write_bytes": write_bytes}
+        plan_path = os.path.join(output_dir, "plan.json")
+        with open(plan_path, 'w', encoding='utf-8') as f:
+            json.dump(plan, f, indent=2)
+
+        bank_outputs = "patch records" if any(bank["mode"] == "record" for bank in plan["banks"]) else "files"
+        log(f"Info: Dry run: {sum(1 for pack in plan['packs'] if pack['ids'])} .pck files and "
+            f"{len(plan['banks'])} Banks {bank_outputs} would be written")
+        log(f"Info: Estimated I/O: {read_bytes} bytes read, {write_bytes} bytes written")
+        if plan["not_found_ids"]:
+            log("Info: IDs not found: " + ", ".join(map(str, plan["not_found_ids"])))
+        log(f"Info: Plan saved to {plan_path}")
+
+
+    def collect_replacements(self, require_wem):
+        # Map every ID to the .wem replacing it, IDs added in the GUI use the selected .wem file
+        replacements = {track["id"]: track["wem"] for track in self.manifest}
+        if self.id_list and require_wem and not self.wem_file:
+            messagebox.showerror("Error", "Please select a .wem file")
+            log("Error: Please select a .wem file")
+            return None
+
+        for numeric_id in self.id_list:
+            replacements[numeric_id] = self.wem_file
+        return replacements
+
+
+    def build_patch_plan(self, replacements):
+        wem_duration_str = self.wem_duration_entry.get().strip()
+        try:
+            entry_duration = float(wem_duration_str) if wem_duration_str else None
+        except ValueError:
+            entry_duration = None
+
+        replacements = {numeric_id: wem_file or self.wem_file for numeric_id, wem_file in replacements.items()}
+        try:
+            return build_patch_plan(replacements, self.manifest, entry_duration)
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return None
+
+
+    def watched_files(self):
+        # Every .wem in use is watched, Banks durations come from the .wem even for IDs no .pck holds
+        files = set(self.last_bank_patches)
+        for replaced in self.last_outputs.values():
+            files.update(replaced.values())
+        files.update(track["wem"] for track in self.manifest)
+        if self.id_list and self.wem_file:
+            files.add(self.wem_file)
+        if self.manifest_path:
+            files.add(self.manifest_path)
+        return {path: file_signature(path) for path in files}
+
+
+    def toggle_watch(self):
+        if self.watching:
+            self.watching = False
+            self.watch_button.configure(text="Watch")
+            log("Info: Watch mode stopped")
+            return
+
+        if not self.last_outputs and not self.last_bank_patches:
+            messagebox.showerror("Error", "Please Repack or Patch the Banks once before starting watch mode")
+            log("Error: Please Repack or Patch the Banks once before starting watch mode")
+            return
+
+        self.watching = True
+        self.watch_stats = self.watched_files()
+        self.watch_pending = {}
+        self.watch_button.configure(text="Stop")
+        log(f"Info: Watching {len(self.watch_stats)} files for changes")
+        self.after(WATCH_INTERVAL_MS, self.poll_watched_files)
+
+
+    def poll_watched_files(self):
+        if not self.watching:
+            return
+
+        changed = []
+        for path, signature in self.watch_stats.items():
+            current = file_signature(path)
+            if current == signature:
+                self.watch_pending.pop(path, None)
+            elif self.watch_pending.get(path) == current:
+                # Unchanged since the last poll, the file is no longer being written
+                changed.append(path)
+            else:
+                self.watch_pending[path] = current
+
+        if changed:
+            try:
+                self.apply_watched_changes(changed)
+            except Exception as e:
+                log(f"Error: Watch update failed: {e}")
+            self.watch_stats = self.watched_files()
+            self.watch_pending = {}
+        self.after(WATCH_INTERVAL_MS, self.poll_watched_files)
+
+
+    def apply_watched_changes(self, changed):
+        if self.manifest_path in changed:
+            log("Info: Manifest changed, repacking and patching everything")
+            self.manifest = load_manifest(self.manifest_path)
+            self.refresh_id_list()
+            self.repack_files()
+            if self.last_bank_patches:
+                self.patch_banks()
+            return
+
+        # Rewrite only the changed entries of the last outputs
+        changed_ids = set()
+        for output_pck_path, replaced in self.last_outputs.items():
+            updates = {numeric_id: wem for numeric_id, wem in replaced.items() if wem in changed}
+            if updates:
+                result = update_pck_entries(output_pck_path, 1, 0, updates)
+                changed_ids.update(result)
+                for numeric_id, how in result.items():
+                    log(f"Info: Updated WEM with ID {numeric_id} in {os.path.basename(output_pck_path)} ({how})")
+
+        replacements = self.collect_replacements(require_wem=False)
+        if replacements is None:
+            return
+        changed_ids.update(numeric_id for numeric_id, wem in replacements.items() if wem in changed)
+
+        changed_banks = [path for path in self.last_bank_patches if path in changed]
+        if not changed_ids and not changed_banks:
+            return
+        patch_plan = self.build_patch_plan({numeric_id: replacements[numeric_id] for numeric_id in self.numeric_ids
+                                            if numeric_id in replacements})
+        if patch_plan is None:
+            return
+
+        # Re-patch only the offsets of the changed IDs, rescan only the changed Banks files
+        rescanned = dict(scan_bank_files(changed_banks, list(patch_plan))) if changed_banks else {}
+        for bank_file_path, (output_file_path, offsets_dict, as_record) in list(self.last_bank_patches.items()):
+            if bank_file_path in changed_banks:
+                offsets_dict = rescanned.get(bank_file_path)
+                if offsets_dict:
+                    patch_bank_file(bank_file_path, output_file_path, offsets_dict, patch_plan, as_record)
+                    self.last_bank_patches[bank_file_path] = (output_file_path, offsets_dict, as_record)
+                continue
+            changed_offsets = {numeric_id: offsets for numeric_id, offsets in offsets_dict.items() if numeric_id in changed_ids}
+            if changed_offsets and as_record:
+                # Records are small, rewrite the whole record from the input
+                patch_bank_file(bank_file_path, output_file_path, offsets_dict, patch_plan, as_record)
+            elif changed_offsets:
+                with open(output_file_path, 'r+b') as f:
+                    apply_bank_writes(f, compute_bank_writes(f, changed_offsets, patch_plan))
+                log(f"Info: Re-patched {len(changed_offsets)} IDs in {os.path.basename(output_file_path)}")
+
+
+def run_extract(args):
+    ids = [parse_id(i) for i in args.ids] if args.ids else None
+    if args.ids_file:
+        with open(args.ids_file, 'r', encoding='utf-8') as f:
+            ids = (ids or []) + [parse_id(i) for i in f.read().split()]
+    package = Package()
+    try:
+        for pck_path in args.pck:
+            package.addfile(pck_path)
+        result = extract_files(package, args.output, modes=args.mode, languages=args.language,
+                               hashes=ids, hash_names=args.hash_names, max_workers=args.workers)
+    finally:
+        package.close()
+    log(f"Info: Extracted {result['written']} files ({result['bytes']} bytes), "
+        f"skipped {result['skipped']} unchanged files")
+    return 0
+
+
+def run_apply_patch(args):
+    apply_patch_record(args.record, args.bank, args.output)
+    log(f"Info: Wrote {args.output}")
+    return 0
+
+
+def run_diff(args):
+    old_package = load_packages(args.old)
+    new_package = load_packages(args.new)
+    try:
+        diff = diff_packages(old_package, new_package, max_workers=args.workers)
+    finally:
+        old_package.close()
+        new_package.close()
+
+    for mode_name, mode_diff in diff.items():
+        for lang_id, lang_diff in mode_diff.items():
+            counts = ", ".join(f"{len(hashes)} {key}" for key, hashes in lang_diff.items() if hashes)
+            log(f"Info: {mode_name} language {lang_id}: {counts}")
+    if not diff:
+        log("Info: No differences")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({mode_name: {str(lang_id): lang_diff for lang_id, lang_diff in mode_diff.items()}
+                       for mode_name, mode_diff in diff.items()}, f, indent=2)
+        log(f"Info: Diff saved to {args.output}")
+    return 0
+
+
+def remove_stale_outputs(output_path):
+    # An output built from the old game file would overwrite the updated one when installed
+    for path in (output_path, output_path + PATCH_RECORD_SUFFIX):
+        if os.path.exists(path):
+            os.remove(path)
+            log(f"Info: Removed outdated {os.path.basename(path)}, it no longer holds any replaced ID")
+
+
+def run_reapply(args):
+    # Re-apply a manifest after a game update, only files whose tables changed are rebuilt
+    manifest = load_manifest(args.manifest)
+    replacements = {track["id"]: track["wem"] for track in manifest}
+    os.makedirs(args.output, exist_ok=True)
+    patch_plan = None
+    rescan = {}
+
+    music_pattern = re.compile(r'Music\d+\.pck$')
+    bank_files = set(find_bank_files(args.new))
+    new_files = sorted(f.path for f in os.scandir(args.new) if music_pattern.match(f.name) or f.path in bank_files)
+    for new_path in new_files:
+        file_name = os.path.basename(new_path)
+        old_path = os.path.join(args.old, file_name)
+        output_path = os.path.join(args.output, file_name)
+        is_bank = new_path in bank_files
+        as_record = is_bank and os.path.exists(output_path + PATCH_RECORD_SUFFIX)
+        # Without a previous output the file is still checked, an update can move IDs between files
+        if (as_record or os.path.exists(output_path)) and os.path.exists(old_path):
+            old_package = load_packages([old_path])
+            new_package = load_packages([new_path])
+            try:
+                # Bank offsets depend on the payload bytes, so same-sized banks are compared too
+                diff = diff_packages(old_package, new_package, verify=is_bank)
+            finally:
+                old_package.close()
+                new_package.close()
+            if not diff:
+                log(f"Info: {file_name} is unchanged, keeping the previous output")
+                continue
+            if is_bank:
+                # Bank table hashes are bank IDs, the music IDs are only found by rescanning
+                log(f"Info: {file_name} changed, rescanning")
+            else:
+                targets = changed_hashes(diff) & set(replacements)
+                if targets:
+                    log(f"Info: {file_name} changed, replaced IDs affected: " + ", ".join(map(str, sorted(targets))))
+                else:
+                    log(f"Info: {file_name} changed, no replaced ID is affected")
+
+        if not is_bank:
+            replaced, padding = repack_pck_file(new_path, output_path, replacements, args.alignment)
+            if replaced:
+                log(f"Info: Repacked {file_name}, {len(replaced)} IDs replaced")
+            else:
+                remove_stale_outputs(output_path)
+            continue
+
+        rescan[new_path] = (output_path, as_record)
+
+    # All Banks files to rescan go to the parallel range scanner at once
+    for new_path, offsets_dict in scan_bank_files(list(rescan), list(replacements)):
+        output_path, as_record = rescan[new_path]
+        if offsets_dict is None:
+            continue
+        if not offsets_dict:
+            log(f"Info: No IDs found in {os.path.basename(new_path)}")
+            remove_stale_outputs(output_path)
+            continue
+        if patch_plan is None:
+            patch_plan = build_patch_plan(replacements, manifest)
+        patch_bank_file(new_path, output_path, offsets_dict, patch_plan, as_record)
+    return 0
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="GI_Music_Replacer", description="Run without arguments to open the GUI")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    extract_parser = commands.add_parser("extract", help="Export entries from one or more .pck files")
+    extract_parser.add_argument("pck", nargs="+", help=".pck files, later files override earlier ones")
+    extract_parser.add_argument("-o", "--output", required=True, help="Output folder")
+    extract_parser.add_argument("--mode", action="append", choices=MODE_NAMES, help="Only export this table (repeatable)")
+    extract_parser.add_argument("--language", action="append", type=str.upper, help="Only export this language (repeatable)")
+    extract_parser.add_argument("--ids", nargs="+", help="Only export these IDs (integers or 16-character hex)")
+    extract_parser.add_argument("--ids-file", help="Text file with whitespace separated IDs")
+    extract_parser.add_argument("--hash-names", action="store_true", help="Name files by 16-character hex ID")
+    extract_parser.add_argument("--workers", type=int, help="Number of parallel writers")
+    extract_parser.set_defaults(func=run_extract)
+
+    apply_parser = commands.add_parser("apply-patch", help="Rebuild a patched Banks file from a patch record")
+    apply_parser.add_argument("record", help=f"Patch record ({PATCH_RECORD_SUFFIX})")
+    apply_parser.add_argument("bank", help="Original Banks file")
+    apply_parser.add_argument("-o", "--output", required=True, help="Patched Banks file to write")
+    apply_parser.set_defaults(func=run_apply_patch)
+
+    diff_parser = commands.add_parser("diff", help="Compare the file tables of two sets of .pck files")
+    diff_parser.add_argument("--old", nargs="+", required=True, help="Old .pck files")
+    diff_parser.add_argument("--new", nargs="+", required=True, help="New .pck files")
+    diff_parser.add_argument("-o", "--output", help="Save the diff as JSON")
+    diff_parser.add_argument("--workers", type=int, help="Number of parallel readers for moved entries")
+    diff_parser.set_defaults(func=run_diff)
+
+    reapply_parser = commands.add_parser("reapply", help="Re-apply a manifest to updated game files, rebuilding only changed files")
+    reapply_parser.add_argument("old", help="Folder with the game files the outputs were made from")
+    reapply_parser.add_argument("new", help="Folder with the updated game files")
+    reapply_parser.add_argument("-m", "--manifest", required=True, help="Manifest (.json)")
+    reapply_parser.add_argument("-o", "--output", required=True, help="Output folder of the previous run")
+    reapply_parser.add_argument("--alignment", type=int, default=1, help="Data alignment of rebuilt .pck files")
+    reapply_parser.set_defaults(func=run_reapply)
+
+    args = parser.parse_args(argv)
+    set_logger_console()
+    try:
+        return args.func(args)
+    except Exception as e:
+        log(f"Error: {e}")
+        return 1
+
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(main(sys.argv[1:]))
     app = App()
     app.mainloop()
\ No newline at end of file